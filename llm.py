@@ -6,7 +6,8 @@ import os
 from functools import lru_cache
 
 import dotenv
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
 
 dotenv.load_dotenv()
@@ -17,6 +18,15 @@ def get_async_client() -> AsyncOpenAI:
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY não configurada no ambiente.")
-    return AsyncOpenAI(api_key=api_key)
-
-            
\ No newline at end of file
+    # Pool amplo + HTTP/2 para que chat em streaming e embeddings não disputem conexões;
+    # o cliente padrão do SDK mantém os demais defaults (ex.: follow_redirects)
+    http_client = DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=512,
+            max_keepalive_connections=256,
+            keepalive_expiry=60.0,
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+    return AsyncOpenAI(api_key=api_key, http_client=http_client)
@@ -3,45 +3,230 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import re
+import string
+import uuid
+from collections import deque
 from dataclasses import dataclass, field
-from typing import Any, AsyncIterator, Dict, List, Optional, cast
+from functools import lru_cache
+from itertools import chain
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, Iterator, List, Literal, Optional, Tuple, cast
 
+import orjson
+from cachetools import TTLCache
 from llm import get_async_client
 from rag_index import KnowledgeIndex
 from services import relatorio_service, rota_service
 from unidecode import unidecode
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionToolParam
 
+try:  # extensão C; sem ela o gate usa regex em trie com a mesma semântica
+    import ahocorasick
+except ImportError:  # pragma: no cover - depende do ambiente
+    ahocorasick = None
 
-EMERGENCY_PATTERNS = re.compile(
-    r"\b(ass[eé]dio|roubado|roubaram|roubo|viol[eê]ncia|agress[aã]o|perigo|ajuda|socorro|emerg[eê]ncia|harassment|robbed|stolen|robbery|violence|aggression|danger|help|emergency|acoso|robaron|robo|violencia|agresi[oó]n|peligro|ayuda|emergencia)\b",
-    re.IGNORECASE,
+
+SESSION_CACHE_SIZE = 10_000
+SESSION_TTL_SECONDS = 3600
+SESSION_MAX_MESSAGES = 20
+TOPIC_CACHE_SIZE = 2048
+
+TopicClass = Literal["emergency", "transport", "offtopic"]
+
+# Grafias em minúsculas, com e sem acento, comparadas como tokens inteiros do texto original:
+# dobrar acentos aqui criaria falsos alarmes (ex.: "robô" viraria o espanhol "robo")
+EMERGENCY_KEYWORDS = (
+    "assédio", "assedio", "roubado", "roubaram", "roubo", "violência", "violencia", "agressão", "agressao",
+    "perigo", "ajuda", "socorro", "emergência", "emergencia", "harassment", "robbed", "stolen", "robbery",
+    "violence", "aggression", "danger", "help", "emergency", "acoso", "robaron", "robo", "agresión",
+    "agresion", "peligro", "ayuda",
 )
 
+TRANSPORT_KEYWORDS = frozenset({
+    "metro",
+    "cptm",
+    "monotrilho",
+    "linha",
+    "linhas",
+    "estacao",
+    "estacoes",
+    "bilhete",
+    "bilhetes",
+    "tarifa",
+    "tarifas",
+    "passagem",
+    "passagens",
+    "trem",
+    "trens",
+    "tremmetropolitano",
+    "viaquatro",
+    "viamobilidade",
+    "onibus",
+    "terminal",
+    "terminais",
+    "corredor",
+    "corredores",
+    "transporte",
+    "baldeacao",
+    "transferencia",
+    "horario",
+    "horarios",
+    "lotacao",
+    "lotacoes",
+    "estudante",
+    "estudantes",
+    "paulista",
+    "billete",
+    "subway",
+    "tube",
+})
+
+TRANSPORT_PHRASES = (
+    "bilhete unico",
+    "sao paulo",
+)
+
+
+# Minúsculas + remoção dos acentos de pt/es numa única passada em C via ``str.translate``
+_ACENTUADAS = "ÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑáàâãäéèêëíìîïóòôõöúùûüçñ"
+_SEM_ACENTO = "aaaaaeeeeiiiiooooouuuucnaaaaaeeeeiiiiooooouuuucn"
+FOLD = str.maketrans(string.ascii_uppercase + _ACENTUADAS, string.ascii_lowercase + _SEM_ACENTO)
+
+
+def _normalizar_topico(texto: str) -> str:
+    """Normaliza para tokens ASCII minúsculos (sem acento) separados por espaço."""
+    if texto.isascii():
+        # Caminho rápido: texto ASCII só precisa de minúsculas
+        folded = texto.lower()
+    else:
+        folded = texto.translate(FOLD)
+        if not folded.isascii():
+            # Só recorre ao unidecode quando sobram caracteres fora da tabela
+            folded = unidecode(folded).lower()
+    return " ".join(re.findall(r"\w+", folded))
+
+
+def _texto_do_gate(texto: str) -> str:
+    """Junta as duas vistas varridas numa passada só: tokens sem acento entre espaços
+    (transporte) e tokens originais em minúsculas entre ``|`` (emergência)."""
+    originais = "|".join(re.findall(r"\w+", texto.lower()))
+    return f" {_normalizar_topico(texto)} |{originais}|"
+
+
+def _topic_patterns(estacoes_norm: Iterable[str]) -> List[Tuple[str, TopicClass]]:
+    # Estações e frases casam como substring; palavras-chave exigem borda de token
+    padroes: List[Tuple[str, TopicClass]] = [(nome, "transport") for nome in estacoes_norm]
+    padroes += [(frase, "transport") for frase in TRANSPORT_PHRASES]
+    padroes += [(f" {palavra} ", "transport") for palavra in TRANSPORT_KEYWORDS]
+    padroes += [(f"|{palavra}|", "emergency") for palavra in EMERGENCY_KEYWORDS]
+    return padroes
+
+
+def _trie_regex(palavras: Iterable[str]) -> str:
+    """Monta uma alternação em trie: prefixos comuns são testados uma vez só."""
+    trie: Dict[str, Any] = {}
+    for palavra in palavras:
+        no = trie
+        for caractere in palavra:
+            no = no.setdefault(caractere, {})
+        no[""] = {}
+
+    def emitir(no: Dict[str, Any]) -> str:
+        terminal = "" in no
+        ramos = [re.escape(caractere) + emitir(filho) for caractere, filho in sorted(no.items()) if caractere]
+        if not ramos:
+            return ""
+        if len(ramos) == 1 and not terminal:
+            return ramos[0]
+        return "(?:" + "|".join(ramos) + ")" + ("?" if terminal else "")
+
+    return emitir(trie)
+
+
+class _TrieRegexMatcher:
+    """Fallback sem pyahocorasick: uma regex em trie por categoria, mesma interface de ``iter``."""
+
+    def __init__(self, padroes: Iterable[Tuple[str, TopicClass]]) -> None:
+        por_categoria: Dict[TopicClass, List[str]] = {}
+        for chave, categoria in padroes:
+            por_categoria.setdefault(categoria, []).append(chave)
+        # Emergência primeiro, como no autômato: o gate retorna no primeiro alerta
+        self._regexes = [
+            (categoria, re.compile(_trie_regex(por_categoria[categoria]), re.ASCII))
+            for categoria in ("emergency", "transport")
+            if por_categoria.get(categoria)
+        ]
+
+    def iter(self, texto: str) -> Iterator[Tuple[int, TopicClass]]:
+        for categoria, regex in self._regexes:
+            encontrado = regex.search(texto)
+            if encontrado:
+                yield encontrado.end() - 1, categoria
+
+
+def _build_topic_automaton(estacoes_norm: Iterable[str]) -> Any:
+    """Autômato único para emergência, palavras de transporte e nomes de estação."""
+    padroes = _topic_patterns(estacoes_norm)
+    if ahocorasick is None:
+        return _TrieRegexMatcher(padroes)
+
+    automaton = ahocorasick.Automaton()
+    for chave, categoria in padroes:
+        automaton.add_word(chave, categoria)
+    automaton.make_automaton()
+    return automaton
+
+
+_SYS_CORE = (
+    "Você é Ceci, assistente virtual do transporte público de São Paulo."
+    " Responda sempre de forma cordial, objetiva e no mesmo idioma do usuário."
+    " Utilize ferramentas quando necessário: planeje rotas precisas, pesquise fatos em search_knowledge"
+    " e gere relatórios somente quando um colaborador solicitar explicitamente."
+    " Nunca responda perguntas que não sejam relacionadas ao transporte público de São Paulo."
+)
+
+_SYS_CONTEXTO = (
+    "Contexto da sessão: usuário é {perfil}. Token disponível: {token}."
+    " Quando usar search_knowledge, cite as informações de forma natural e referencial."
+    " Se o conteúdo do RAG não for suficiente, explique com transparência."
+    " Se a pergunta parecer fora do transporte público de São Paulo, peça gentilmente que o usuário confirme"
+    " mencionando estação, linha ou serviço antes de recusar."
+)
+
+# Só existem 4 combinações de perfil x token: prefixo idêntico a cada turno favorece o prompt cache da OpenAI
+_BASE_MESSAGES: Dict[Tuple[str, bool], Tuple[Dict[str, str], ...]] = {
+    (perfil, has_token): (
+        {"role": "system", "content": _SYS_CORE},
+        {"role": "system", "content": _SYS_CONTEXTO.format(perfil=perfil, token="sim" if has_token else "não")},
+    )
+    for perfil in ("passageiro", "colaborador")
+    for has_token in (False, True)
+}
+
 
 @dataclass
 class SessionState:
-    messages: List[Dict[str, Any]] = field(default_factory=list)
+    # Mantém só o histórico mais recente para evitar custo excessivo; o deque descarta em O(1)
+    messages: Deque[Dict[str, Any]] = field(default_factory=lambda: deque(maxlen=SESSION_MAX_MESSAGES))
 
     def append(self, message: Dict[str, Any]) -> None:
         self.messages.append(message)
 
-    def prune(self, max_messages: int = 20) -> None:
-        if len(self.messages) <= max_messages:
-            return
-        # Mantém o histórico mais recente para evitar custo excessivo
-        self.messages = self.messages[-max_messages:]
-
 
 class ToolRegistry:
     """Registra e executa ferramentas disponíveis para o modelo."""
 
     def __init__(self, knowledge_index: KnowledgeIndex) -> None:
         self._knowledge_index = knowledge_index
+        # As definições são fixas por perfil: monta uma vez e reutiliza a cada turno
+        self._tools_passageiro = self._build_tools("Passageiro")
+        self._tools_colaborador = self._build_tools("Colaborador")
+
+    def list_tools(self, tipo_usuario: str) -> Tuple[Dict[str, Any], ...]:
+        return self._tools_colaborador if tipo_usuario == "Colaborador" else self._tools_passageiro
 
-    def list_tools(self, tipo_usuario: str) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _build_tools(tipo_usuario: str) -> Tuple[Dict[str, Any], ...]:
         tools: List[Dict[str, Any]] = [
             {
                 "type": "function",
@@ -119,22 +304,23 @@ class ToolRegistry:
                 }
             )
 
-        return tools
+        return tuple(tools)
 
     async def call(self, name: str, arguments: Dict[str, Any], *, tipo_usuario: str, token: Optional[str]) -> str:
         if name == "search_knowledge":
             query = arguments.get("query", "")
             top_k = int(arguments.get("top_k", 3))
             resultados = await self._knowledge_index.search(query, top_k=top_k)
-            return json.dumps({"results": resultados}, ensure_ascii=False)
+            return orjson.dumps({"results": resultados}).decode()
 
         if name == "plan_route":
             origem = arguments.get("origin") or arguments.get("origem")
             destino = arguments.get("destination") or arguments.get("destino")
             if not origem or not destino:
-                return json.dumps({"error": "Forneça origem e destino válidos."}, ensure_ascii=False)
+                return orjson.dumps({"error": "Forneça origem e destino válidos."}).decode()
             try:
-                plano = rota_service.plan_route(origem, destino)
+                # plan_route pode renovar o status com uma chamada HTTP bloqueante: fora do event loop
+                plano = await asyncio.to_thread(rota_service.plan_route, origem, destino)
                 payload = {
                     "origem": plano.origem,
                     "destino": plano.destino,
@@ -143,24 +329,24 @@ class ToolRegistry:
                     "baldeacoes": plano.baldeacoes,
                     "texto": plano.formatar(),
                 }
-                return json.dumps(payload, ensure_ascii=False)
+                return orjson.dumps(payload).decode()
             except ValueError as exc:
-                return json.dumps({"error": str(exc)}, ensure_ascii=False)
+                return orjson.dumps({"error": str(exc)}).decode()
 
         if name == "generate_report":
             if tipo_usuario != "Colaborador":
-                return json.dumps({"error": "Apenas colaboradores podem gerar relatórios."}, ensure_ascii=False)
+                return orjson.dumps({"error": "Apenas colaboradores podem gerar relatórios."}).decode()
             if not token:
-                return json.dumps({"error": "Token de autenticação ausente para geração de relatórios."}, ensure_ascii=False)
+                return orjson.dumps({"error": "Token de autenticação ausente para geração de relatórios."}).decode()
 
             descricao = arguments.get("description") or arguments.get("texto")
             if not descricao:
-                return json.dumps({"error": "Descreva o que deve constar no relatório."}, ensure_ascii=False)
+                return orjson.dumps({"error": "Descreva o que deve constar no relatório."}).decode()
 
-            resultado = relatorio_service.gerar_relatorio(descricao, tipo_usuario="Colaborador", token=token)
-            return json.dumps(resultado, ensure_ascii=False)
+            resultado = await relatorio_service.gerar_relatorio(descricao, tipo_usuario="Colaborador", token=token)
+            return orjson.dumps(resultado).decode()
 
-        return json.dumps({"error": f"Ferramenta desconhecida: {name}"}, ensure_ascii=False)
+        return orjson.dumps({"error": f"Ferramenta desconhecida: {name}"}).decode()
 
 
 class LLMOrchestrator:
@@ -170,7 +356,20 @@ class LLMOrchestrator:
         self._client = get_async_client()
         self._knowledge_index = KnowledgeIndex(self._client)
         self._tool_registry = ToolRegistry(self._knowledge_index)
-        self._sessions: Dict[str, SessionState] = {}
+        # Sessões ociosas expiram e o total é limitado, evitando crescimento sem fim em produção
+        self._sessions: TTLCache[str, SessionState] = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_TTL_SECONDS)
+
+        # reforça o gate com os nomes das estações para evitar falsos positivos
+        try:
+            estacoes = rota_service.list_all_stations()
+        except Exception:
+            estacoes = []
+        self._stations_norm = frozenset(
+            nome for nome in (_normalizar_topico(estacao) for estacao in estacoes) if nome
+        )
+        self._topic_automaton = _build_topic_automaton(self._stations_norm)
+        # Reenvios e retentativas da mesma mensagem não repetem a varredura do gate
+        self._classify_topic = lru_cache(maxsize=TOPIC_CACHE_SIZE)(self._scan_topic)
 
     async def handle_message(
         self,
@@ -183,11 +382,12 @@ class LLMOrchestrator:
             yield "Não recebi nenhuma mensagem. Poderia repetir?"
             return
 
-        if EMERGENCY_PATTERNS.search(user_text):
+        categoria = self._classify_topic(user_text)
+        if categoria == "emergency":
             yield self._resposta_emergencia(tipo_usuario)
             return
 
-        if not self._is_transport_topic(user_text):
+        if categoria == "offtopic":
             aviso = (
                 "Posso te ajudar com o transporte público de São Paulo."
                 " Me conta qual linha, estação ou serviço do metrô, CPTM ou ônibus você quer saber?"
@@ -195,14 +395,13 @@ class LLMOrchestrator:
             yield aviso
             return
 
-        session = self._sessions.setdefault(session_id, SessionState())
+        session = self._sessions.get(session_id) or SessionState()
+        # Reinsere a cada mensagem para que o TTL conte a partir do último uso
+        self._sessions[session_id] = session
         session.append({"role": "user", "content": user_text})
 
-        try:
-            async for chunk in self._chat_loop(session, tipo_usuario, token):
-                yield chunk
-        finally:
-            session.prune()
+        async for chunk in self._chat_loop(session, tipo_usuario, token):
+            yield chunk
 
     def _resposta_emergencia(self, tipo_usuario: str) -> str:
         if tipo_usuario == "Colaborador":
@@ -226,14 +425,15 @@ class LLMOrchestrator:
 
         # Loop para lidar com chamadas de ferramenta sucessivas
         while True:
-            messages = cast(List[ChatCompletionMessageParam], base_messages + session.messages)
+            # Encadeia sem copiar: o SDK consome o iterável uma única vez ao montar a requisição
+            messages = cast(Iterable[ChatCompletionMessageParam], chain(base_messages, session.messages))
             try:
                 stream = await self._client.chat.completions.create(  # type: ignore[arg-type,call-arg]
                     model="gpt-4.1",
                     messages=messages,
                     temperature=0.4,
                     stream=True,
-                    tools=cast(List[ChatCompletionToolParam], tool_defs),
+                    tools=cast(Iterable[ChatCompletionToolParam], tool_defs),
                     tool_choice="auto",
                 )
             except Exception as exc:
@@ -264,17 +464,20 @@ class LLMOrchestrator:
                     call_info = delta.tool_calls[0]
                     if tool_call is None:
                         tool_call = {
-                            "id": call_info.id or f"call_{len(session.messages)}",
+                            "id": call_info.id or f"call_{uuid.uuid4().hex}",
                             "name": "",
-                            "arguments": "",
+                            "arguments": [],
                         }
                     if call_info.function:
                         if call_info.function.name:
                             tool_call["name"] = call_info.function.name
                         if call_info.function.arguments:
-                            tool_call["arguments"] += call_info.function.arguments
+                            tool_call["arguments"].append(call_info.function.arguments)
 
             if tool_call and tool_call.get("name"):
+                # Deltas acumulados em lista e unidos uma única vez (evita concatenação quadrática)
+                argumentos = "".join(tool_call["arguments"])
+
                 # Remove qualquer conteúdo parcial enviado ao usuário, pois não é resposta final
                 if final_text:
                     # Não reenvia chunks em caso de tool call; limpa buffer do usuário
@@ -290,7 +493,7 @@ class LLMOrchestrator:
                                 "type": "function",
                                 "function": {
                                     "name": tool_call["name"],
-                                    "arguments": tool_call.get("arguments", ""),
+                                    "arguments": argumentos,
                                 },
                             }
                         ],
@@ -298,8 +501,8 @@ class LLMOrchestrator:
                 )
 
                 try:
-                    args = json.loads(tool_call.get("arguments", "{}") or "{}")
-                except json.JSONDecodeError:
+                    args = orjson.loads(argumentos or "{}")
+                except orjson.JSONDecodeError:
                     args = {}
                 tool_output = await self._tool_registry.call(
                     tool_call["name"],
@@ -326,99 +529,15 @@ class LLMOrchestrator:
             session.append({"role": "assistant", "content": resposta})
             break
 
-    def _base_messages(self, tipo_usuario: str, has_token: bool) -> List[Dict[str, str]]:
+    def _base_messages(self, tipo_usuario: str, has_token: bool) -> Tuple[Dict[str, str], ...]:
         perfil = "colaborador" if tipo_usuario == "Colaborador" else "passageiro"
-        return [
-            {
-                "role": "system",
-                "content": (
-                    "Você é Ceci, assistente virtual do transporte público de São Paulo."
-                    " Responda sempre de forma cordial, objetiva e no mesmo idioma do usuário."
-                    " Utilize ferramentas quando necessário: planeje rotas precisas, pesquise fatos em search_knowledge"
-                    " e gere relatórios somente quando um colaborador solicitar explicitamente."
-                    " Nunca responda perguntas que não sejam relacionadas ao transporte público de São Paulo."
-                ),
-            },
-            {
-                "role": "system",
-                "content": (
-                    f"Contexto da sessão: usuário é {perfil}. Token disponível: {'sim' if has_token else 'não'}."
-                    " Quando usar search_knowledge, cite as informações de forma natural e referencial."
-                    " Se o conteúdo do RAG não for suficiente, explique com transparência."
-                    " Se a pergunta parecer fora do transporte público de São Paulo, peça gentilmente que o usuário confirme"
-                    " mencionando estação, linha ou serviço antes de recusar."
-                ),
-            },
-        ]
-
-    def _is_transport_topic(self, texto: str) -> bool:
-        texto_norm = texto.lower()
-        texto_unaccented = unidecode(texto_norm)
-
-        if not texto_unaccented.strip():
-            return False
-
-        token_keywords = {
-            "metro",
-            "cptm",
-            "monotrilho",
-            "linha",
-            "linhas",
-            "estacao",
-            "estacoes",
-            "bilhete",
-            "bilhetes",
-            "tarifa",
-            "tarifas",
-            "passagem",
-            "passagens",
-            "trem",
-            "trens",
-            "tremmetropolitano",
-            "viaquatro",
-            "viamobilidade",
-            "onibus",
-            "terminal",
-            "terminais",
-            "corredor",
-            "corredores",
-            "transporte",
-            "baldeacao",
-            "transferencia",
-            "horario",
-            "horarios",
-            "lotacao",
-            "lotacoes",
-            "estudante",
-            "estudantes",
-            "paulista",
-            "billete",
-            "subway",
-            "tube",
-        }
-
-        frase_keywords = (
-            "bilhete unico",
-            "sao paulo",
-        )
-
-        tokens_texto = set(re.findall(r"\w+", texto_unaccented))
-
-        if token_keywords & tokens_texto:
-            return True
-
-        if any(frase in texto_unaccented for frase in frase_keywords):
-            return True
-
-        # reforça com os nomes das estações para evitar falsos positivos
-        try:
-            estacoes = rota_service.list_all_stations()
-        except Exception:
-            estacoes = []
-
-        for estacao in estacoes:
-            estacao_norm = unidecode(estacao.lower())
-            if estacao_norm in texto_unaccented or estacao_norm in tokens_texto:
-                return True
-
-        return False
+        return _BASE_MESSAGES[(perfil, has_token)]
+
+    def _scan_topic(self, texto: str) -> TopicClass:
+        """Uma única passada do autômato decide entre emergência, transporte e fora de escopo."""
+        encontrou_transporte = False
+        for _, categoria in self._topic_automaton.iter(_texto_do_gate(texto)):
+            if categoria == "emergency":
+                return "emergency"
+            encontrou_transporte = True
+        return "transport" if encontrou_transporte else "offtopic"
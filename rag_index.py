@@ -4,13 +4,40 @@ from __future__ import annotations
 
 import asyncio
 import hashlib
-import json
-import math
+import os
+from collections import OrderedDict
 from dataclasses import dataclass
+from itertools import chain
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-from openai import AsyncOpenAI
+import numpy as np
+import orjson
+from openai import AsyncOpenAI, RateLimitError
+
+try:  # FAISS é opcional: sem ele a busca exaustiva em NumPy continua disponível
+    import faiss
+except ImportError:  # pragma: no cover - depende do ambiente
+    faiss = None
+
+
+HNSW_NEIGHBORS = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# Acima deste tamanho a busca em NumPy pré-filtra por Hamming nos embeddings binarizados
+BINARY_RERANK_CANDIDATES = 100
+QUERY_CACHE_SIZE = 1024
+# Consultas concorrentes dentro desta janela viram uma única chamada de embeddings
+QUERY_BATCH_INTERVAL = 0.01
+QUERY_BATCH_MAX = 32
+EMBED_CONCURRENCY = 8
+EMBED_MAX_ATTEMPTS = 5
+EMBED_BACKOFF_SECONDS = 0.5
+
+DATA_DIR = Path("data")
+SOURCE_FILES = ("faq_ccr.json", "faq_passageiro.json", "data_linhas.json")
+# Incremente ao mudar o texto gerado em _load_documents: o hash do cache cobre só os bytes das fontes
+DOCUMENT_LAYOUT_VERSION = b"1"
 
 
 @dataclass
@@ -32,55 +59,148 @@ class KnowledgeIndex:
         self._client = client
         self._cache_path = Path(cache_path)
         self._embedding_model = embedding_model
-        self._documents: List[KnowledgeDocument] = self._load_documents()
-        self._embeddings: Optional[List[List[float]]] = None
-        self._data_hash = self._compute_hash(self._documents)
+        # Documentos carregados sob demanda em ensure_ready, fora do __init__ e do event loop
+        self._documents: List[KnowledgeDocument] = []
+        self._data_hash: Optional[str] = None
+        self._emb_matrix: Optional[np.ndarray] = None
+        self._emb_bits: Optional[np.ndarray] = None
+        self._faiss_index: Optional[Any] = None
+        self._query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._embed_semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
         self._lock = asyncio.Lock()
 
     async def ensure_ready(self) -> None:
         async with self._lock:
-            if self._embeddings is not None:
+            if self._emb_matrix is not None:
                 return
 
-            cached = self._read_cache()
-            if cached and cached.get("hash") == self._data_hash:
-                self._embeddings = cached["embeddings"]
-                return
+            fontes = await asyncio.to_thread(self._read_sources)
+            self._data_hash = self._compute_hash(fontes)
 
-            self._embeddings = await self._embed_documents(self._documents)
-            self._write_cache({
-                "hash": self._data_hash,
-                "embeddings": self._embeddings,
-                "documents": [doc.__dict__ for doc in self._documents],
-                "embedding_model": self._embedding_model,
-            })
+            # Matriz (N, D) contígua e pré-normalizada: a busca vira um único produto matriz-vetor
+            cached = await asyncio.to_thread(self._read_cache)
+            if cached is not None:
+                # Cache válido já traz os documentos: as fontes nem precisam ser interpretadas
+                self._emb_matrix, self._documents = cached
+            else:
+                self._documents = self._load_documents(fontes)
+                embeddings = await self._embed_documents(self._documents)
+                matrix = np.asarray(embeddings, dtype=np.float32) if embeddings else np.empty((0, 0), np.float32)
+                self._emb_matrix = self._normalize_rows(matrix)
+                # Serializar e gravar MBs de embeddings bloquearia o streaming das outras sessões
+                await asyncio.to_thread(self._write_cache, self._emb_matrix, {
+                    "hash": self._data_hash,
+                    "documents": [doc.__dict__ for doc in self._documents],
+                    "embedding_model": self._embedding_model,
+                })
+            # Índice salvo só é reaproveitado junto com o cache válido; embeddings novos pedem índice novo
+            self._faiss_index = await asyncio.to_thread(
+                self._load_or_build_faiss_index, self._emb_matrix, cached is not None
+            )
+            if self._faiss_index is None:
+                # Um bit de sinal por dimensão: 32x menos memória lida na varredura
+                self._emb_bits = np.packbits(self._emb_matrix > 0, axis=1)
 
     async def search(self, query: str, top_k: int = 3) -> List[Dict[str, str]]:
         await self.ensure_ready()
         if not query.strip():
             return []
 
+        assert self._emb_matrix is not None
+        total = self._emb_matrix.shape[0]
+        if total == 0:
+            return []
+
         query_embedding = await self._embed_text(query)
-        scored = []
-        assert self._embeddings is not None
-        for doc, emb in zip(self._documents, self._embeddings):
-            score = self._cosine_similarity(query_embedding, emb)
-            scored.append((score, doc))
+        query_vec = self._normalize_rows(np.asarray(query_embedding, dtype=np.float32)[None, :])[0]
+        k = min(max(1, top_k), total)
 
-        scored.sort(key=lambda item: item[0], reverse=True)
         resultados = []
-        for score, doc in scored[: max(1, top_k)]:
+        for idx, score in zip(*self._rank(query_vec, k)):
+            doc = self._documents[idx]
             resultados.append({
                 "doc_id": doc.doc_id,
-                "score": round(score, 4),
+                "score": round(float(score), 4),
                 "text": doc.text,
                 "metadata": doc.metadata,
             })
         return resultados
 
-    def _load_documents(self) -> List[KnowledgeDocument]:
+    def _rank(self, query_vec: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        if self._faiss_index is not None:
+            scores, ids = self._faiss_index.search(query_vec[None, :], k)
+            encontrados = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i >= 0]
+            return [i for i, _ in encontrados], [s for _, s in encontrados]
+
+        assert self._emb_matrix is not None
+        if self._emb_bits is not None and self._emb_bits.shape[0] > BINARY_RERANK_CANDIDATES:
+            # Distância de Hamming via POPCNT seleciona candidatos; o rerank em FP32 mantém o score exato
+            query_bits = np.packbits(query_vec > 0)
+            distancias = np.bitwise_count(np.bitwise_xor(self._emb_bits, query_bits)).sum(axis=1, dtype=np.int32)
+            candidatos = np.argpartition(distancias, BINARY_RERANK_CANDIDATES - 1)[:BINARY_RERANK_CANDIDATES]
+        else:
+            candidatos = np.arange(self._emb_matrix.shape[0])
+
+        scores = self._emb_matrix[candidatos] @ query_vec
+
+        # Seleciona só os top_k em O(N) e ordena apenas esses
+        k = min(k, len(candidatos))
+        top_idx = np.argpartition(-scores, k - 1)[:k]
+        top_idx = top_idx[np.argsort(-scores[top_idx])]
+        return candidatos[top_idx].tolist(), scores[top_idx].tolist()
+
+    def _load_or_build_faiss_index(self, matrix: np.ndarray, reaproveitar: bool) -> Optional[Any]:
+        if faiss is None or matrix.shape[0] == 0:
+            return None
+
+        index_path = self._faiss_index_path()
+        index = None
+        if reaproveitar and index_path.exists():
+            try:
+                index = faiss.read_index(str(index_path))
+            except Exception:
+                index = None
+            if index is not None and (index.ntotal != matrix.shape[0] or index.d != matrix.shape[1]):
+                index = None
+
+        if index is None:
+            index = faiss.IndexHNSWFlat(matrix.shape[1], HNSW_NEIGHBORS, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.add(np.ascontiguousarray(matrix))
+            try:
+                index_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = index_path.with_suffix(".tmp")
+                faiss.write_index(index, str(tmp_path))
+                tmp_path.replace(index_path)
+                # Índices de dados ou modelos anteriores não servem mais: evita órfãos em .cache/
+                for antigo in index_path.parent.glob(f"{self._cache_path.stem}.*.faiss"):
+                    if antigo != index_path:
+                        antigo.unlink(missing_ok=True)
+            except Exception:
+                # Persistir o índice é só uma otimização de cold start
+                pass
+
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    def _faiss_index_path(self) -> Path:
+        # Mesma identidade do cache .npy/.json: hash dos dados + modelo de embedding
+        chave = hashlib.sha256(f"{self._data_hash}\0{self._embedding_model}".encode("utf-8")).hexdigest()
+        return self._cache_path.with_name(f"{self._cache_path.stem}.{chave[:16]}.faiss")
+
+    @staticmethod
+    def _read_sources() -> Dict[str, bytes]:
+        fontes: Dict[str, bytes] = {}
+        for nome in SOURCE_FILES:
+            path = DATA_DIR / nome
+            if path.exists():
+                fontes[nome] = path.read_bytes()
+        return fontes
+
+    def _load_documents(self, fontes: Dict[str, bytes]) -> List[KnowledgeDocument]:
         docs: List[KnowledgeDocument] = []
-        base_path = Path("data")
 
         def add_doc(doc_id: str, text: str, metadata: Optional[Dict[str, str]] = None) -> None:
             docs.append(
@@ -91,9 +211,8 @@ class KnowledgeIndex:
                 )
             )
 
-        faq_ccr_path = base_path / "faq_ccr.json"
-        if faq_ccr_path.exists():
-            data = json.loads(faq_ccr_path.read_text(encoding="utf-8"))
+        if "faq_ccr.json" in fontes:
+            data = orjson.loads(fontes["faq_ccr.json"])
             faqs = self._extract_list(data, "faqs_colaborador")
             for idx, faq in enumerate(faqs):
                 pergunta = faq.get("question") or faq.get("pergunta") or ""
@@ -104,9 +223,8 @@ class KnowledgeIndex:
                     {"tipo": "faq_colaborador"},
                 )
 
-        faq_passageiro_path = base_path / "faq_passageiro.json"
-        if faq_passageiro_path.exists():
-            data = json.loads(faq_passageiro_path.read_text(encoding="utf-8"))
+        if "faq_passageiro.json" in fontes:
+            data = orjson.loads(fontes["faq_passageiro.json"])
             faqs = self._extract_list(data, "faqs_passageiro")
             for idx, faq in enumerate(faqs):
                 pergunta = faq.get("question") or faq.get("pergunta") or ""
@@ -117,9 +235,8 @@ class KnowledgeIndex:
                     {"tipo": "faq_passageiro"},
                 )
 
-        linhas_path = base_path / "data_linhas.json"
-        if linhas_path.exists():
-            linhas = json.loads(linhas_path.read_text(encoding="utf-8")).get("linhas", [])
+        if "data_linhas.json" in fontes:
+            linhas = orjson.loads(fontes["data_linhas.json"]).get("linhas", [])
             for idx, linha in enumerate(linhas):
                 nome = linha.get("nome", "Linha")
                 operadora = linha.get("operadora", "")
@@ -133,53 +250,128 @@ class KnowledgeIndex:
 
     async def _embed_documents(self, docs: Sequence[KnowledgeDocument]) -> List[List[float]]:
         textos = [doc.text for doc in docs]
-        embeddings: List[List[float]] = []
+        # Textos repetidos entre FAQs são embedados uma única vez
+        unicos = list(dict.fromkeys(textos))
 
         # Cria diretório de cache, se necessário
         self._cache_path.parent.mkdir(parents=True, exist_ok=True)
 
         batch_size = 32
-        for start in range(0, len(textos), batch_size):
-            batch = textos[start : start + batch_size]
-            response = await self._client.embeddings.create(
-                model=self._embedding_model,
-                input=batch,
-            )
-            embeddings.extend([item.embedding for item in response.data])
-        return embeddings
+        lotes = [unicos[start : start + batch_size] for start in range(0, len(unicos), batch_size)]
+        resultados = await asyncio.gather(*(self._request_embeddings(lote) for lote in lotes))
+        por_texto = dict(zip(unicos, chain.from_iterable(resultados)))
+        return [por_texto[texto] for texto in textos]
+
+    async def _request_embeddings(self, inputs: List[str]) -> List[List[float]]:
+        # Semáforo limita lotes simultâneos; 429 é retentado com backoff exponencial
+        async with self._embed_semaphore:
+            tentativa = 0
+            while True:
+                try:
+                    response = await self._client.embeddings.create(
+                        model=self._embedding_model,
+                        input=inputs,
+                    )
+                    return [item.embedding for item in response.data]
+                except RateLimitError:
+                    tentativa += 1
+                    if tentativa >= EMBED_MAX_ATTEMPTS:
+                        raise
+                    await asyncio.sleep(EMBED_BACKOFF_SECONDS * 2 ** (tentativa - 1))
 
     async def _embed_text(self, text: str) -> List[float]:
-        response = await self._client.embeddings.create(
-            model=self._embedding_model,
-            input=text,
-        )
-        return response.data[0].embedding
+        # Re-prompts e retentativas do chat repetem a mesma consulta: evita nova ida à API
+        chave = hashlib.sha256(
+            f"{self._embedding_model}\0{text.strip().lower()}".encode("utf-8")
+        ).hexdigest()
+        cached = self._query_cache.get(chave)
+        if cached is not None:
+            self._query_cache.move_to_end(chave)
+            return cached
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_pending())
+
+        embedding = await future
+        self._query_cache[chave] = embedding
+        if len(self._query_cache) > QUERY_CACHE_SIZE:
+            self._query_cache.popitem(last=False)
+        return embedding
+
+    async def _flush_pending(self) -> None:
+        # Consulta sozinha vai direto; a janela só vale quando já há outras esperando juntas
+        if len(self._pending) > 1:
+            await asyncio.sleep(QUERY_BATCH_INTERVAL)
+        lote: List[Tuple[str, asyncio.Future]] = []
+        try:
+            while self._pending:
+                lote = self._pending[:QUERY_BATCH_MAX]
+                del self._pending[:QUERY_BATCH_MAX]
+                textos = list(dict.fromkeys(texto for texto, _ in lote))
+                try:
+                    por_texto = dict(zip(textos, await self._request_embeddings(textos)))
+                except Exception as exc:
+                    for _, future in lote:
+                        if not future.done():
+                            future.set_exception(exc)
+                    continue
+
+                for texto, future in lote:
+                    if not future.done():
+                        future.set_result(por_texto[texto])
+        finally:
+            # Cancelamento (ex.: shutdown) não pode deixar quem chamou search() esperando para sempre
+            for _, future in lote + self._pending:
+                if not future.done():
+                    future.cancel()
+            self._pending.clear()
 
     @staticmethod
-    def _compute_hash(documents: Iterable[KnowledgeDocument]) -> str:
-        payload = [doc.__dict__ for doc in documents]
-        blob = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
-        return hashlib.sha256(blob).hexdigest()
+    def _compute_hash(fontes: Dict[str, bytes]) -> str:
+        digest = hashlib.sha256(DOCUMENT_LAYOUT_VERSION)
+        for nome in sorted(fontes):
+            digest.update(b"\0" + nome.encode("utf-8") + b"\0")
+            digest.update(fontes[nome])
+        return digest.hexdigest()
 
-    def _read_cache(self) -> Optional[Dict]:
-        if not self._cache_path.exists():
+    def _read_cache(self) -> Optional[Tuple[np.ndarray, List[KnowledgeDocument]]]:
+        matrix_path = self._cache_path.with_suffix(".npy")
+        if not self._cache_path.exists() or not matrix_path.exists():
             return None
         try:
-            return json.loads(self._cache_path.read_text(encoding="utf-8"))
+            meta = orjson.loads(self._cache_path.read_bytes())
+            if meta.get("hash") != self._data_hash or meta.get("embedding_model") != self._embedding_model:
+                return None
+            # mmap: sem parse no cold start, o SO carrega as páginas sob demanda
+            matrix = np.load(matrix_path, mmap_mode="r")
+            documentos = [KnowledgeDocument(**doc) for doc in meta.get("documents", [])]
         except Exception:
             return None
+        if matrix.ndim != 2 or matrix.shape[0] != len(documentos):
+            return None
+        return matrix, documentos
+
+    def _write_cache(self, matrix: np.ndarray, meta: Dict) -> None:
+        # A matriz vai primeiro; o JSON com o hash só é trocado quando ela já está no lugar
+        matrix_path = self._cache_path.with_suffix(".npy")
+        tmp_matrix = self._cache_path.with_suffix(".npy.tmp")
+        with tmp_matrix.open("wb", buffering=1 << 20) as fh:
+            np.save(fh, matrix)
+        os.replace(tmp_matrix, matrix_path)
 
-    def _write_cache(self, data: Dict) -> None:
         tmp_path = self._cache_path.with_suffix(".tmp")
-        tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
-        tmp_path.replace(self._cache_path)
+        with tmp_path.open("wb") as fh:
+            fh.write(orjson.dumps(meta))
+        os.replace(tmp_path, self._cache_path)
 
     @staticmethod
-    def _cosine_similarity(a: Sequence[float], b: Sequence[float]) -> float:
-        dot = sum(x * y for x, y in zip(a, b))
-        norm_a = math.sqrt(sum(x * x for x in a)) or 1.0
-        norm_b = math.sqrt(sum(x * x for x in b)) or 1.0
-        return dot / (norm_a * norm_b)
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        if matrix.size == 0:
+            return matrix
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+        return matrix
 
     @staticmethod
     def _extract_list(data: Dict, key: str) -> List[Dict]:
@@ -1,119 +1,151 @@
 # services/relatorio_service.py
+import asyncio
 import datetime
+import hashlib
 import os
+import time
+from pathlib import Path
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
 from reportlab.lib.colors import blue, red, black
 import jwt
+from cachetools import TTLCache
 from jwt import InvalidTokenError
 
 SECRET = "minhaChaveSuperSecretaParaJwtComTamanhoAdequado!"  # Deve ser a mesma do app.py
 
+# Diretório de relatórios criado uma vez no import, não a cada PDF
+_REPORTS_DIR = Path("reports")
+os.makedirs(_REPORTS_DIR, exist_ok=True)
+
+# Tokens já validados: chave é o hash do token (não guarda o token cru), valor é (info, exp)
+JWT_CACHE_TTL = 300
+_JWT_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=JWT_CACHE_TTL)
+
+# Estilos customizados: montados uma vez no import e compartilhados entre relatórios
+_STYLES = getSampleStyleSheet()
+
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=18,
+    spaceAfter=30,
+    alignment=TA_CENTER,
+    textColor=blue
+)
+
+_HEADER_STYLE = ParagraphStyle(
+    'CustomHeader',
+    parent=_STYLES['Heading2'],
+    fontSize=14,
+    spaceAfter=12,
+    textColor=black
+)
+
+_CONTENT_STYLE = ParagraphStyle(
+    'CustomContent',
+    parent=_STYLES['Normal'],
+    fontSize=12,
+    spaceAfter=12,
+    alignment=TA_JUSTIFY,
+    leftIndent=20,
+    rightIndent=20
+)
+
+_FOOTER_STYLE = ParagraphStyle(
+    'Footer',
+    parent=_STYLES['Normal'],
+    fontSize=10,
+    alignment=TA_CENTER,
+    textColor=red
+)
+
 def get_colaborador_info_from_token(token: str) -> dict:
     """
     Extrai informações do colaborador do token JWT.
     Retorna dict com login, nome, etc.
+    Tokens válidos ficam em cache até o menor entre JWT_CACHE_TTL e o próprio ``exp``.
     """
+    token_limp = token.strip().strip('"').strip()
+    # Remove só o prefixo, comparando sem diferenciar maiúsculas e sem copiar o token inteiro
+    clean_token = token_limp[7:] if token_limp[:7].lower() == "bearer " else token_limp
+
+    chave = hashlib.blake2b(clean_token.encode(), digest_size=16).digest()
+    cached = _JWT_CACHE.get(chave)
+    if cached is not None:
+        info, expira_em = cached
+        if expira_em is None or expira_em > time.time():
+            return dict(info)
+        _JWT_CACHE.pop(chave, None)
+
     try:
-        token_limp = token.strip().strip('"')
-        if token_limp.lower().startswith("bearer "):
-            token_limp = token_limp.split(" ", 1)[1]
-        clean_token = token_limp
         payload = jwt.decode(clean_token, SECRET, algorithms=["HS256"])
-        return {
-            "login": payload.get("sub"),
-            "nome": payload.get("name", payload.get("sub", "Colaborador")),
-            "is_valid": True
-        }
     except InvalidTokenError:
+        # Tokens inválidos nunca entram no cache
         return {"is_valid": False}
 
-def gerar_pdf_relatorio(titulo: str, conteudo: str, colaborador_nome: str, data_hora: str) -> str:
+    info = {
+        "login": payload.get("sub"),
+        "nome": payload.get("name", payload.get("sub", "Colaborador")),
+        "is_valid": True
+    }
+    # jwt.decode já rejeitou tokens expirados; o ``exp`` guardado limita a vida da entrada
+    _JWT_CACHE[chave] = (info, payload.get("exp"))
+    return dict(info)
+
+def gerar_pdf_relatorio(
+    titulo: str,
+    conteudo: str,
+    colaborador_nome: str,
+    data_hora: str,
+    gerado_em: datetime.datetime | None = None,
+) -> str:
     """
     Gera um arquivo PDF do relatório e retorna o caminho do arquivo.
+    ``gerado_em`` reaproveita o instante já capturado por quem chama para nomear o arquivo.
     """
-    # Cria diretório de relatórios se não existir
-    reports_dir = "reports"
-    if not os.path.exists(reports_dir):
-        os.makedirs(reports_dir)
-    
     # Nome do arquivo com timestamp
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    dt = gerado_em or datetime.datetime.now()
+    timestamp = f"{dt.year}{dt.month:02d}{dt.day:02d}_{dt.hour:02d}{dt.minute:02d}{dt.second:02d}"
     filename = f"relatorio_{timestamp}_{colaborador_nome.replace(' ', '_')}.pdf"
-    filepath = os.path.join(reports_dir, filename)
-    
-    # Criar o documento PDF
-    doc = SimpleDocTemplate(filepath, pagesize=A4)
-    styles = getSampleStyleSheet()
-    
-    # Estilos customizados
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        textColor=blue
-    )
-    
-    header_style = ParagraphStyle(
-        'CustomHeader',
-        parent=styles['Heading2'],
-        fontSize=14,
-        spaceAfter=12,
-        textColor=black
-    )
-    
-    content_style = ParagraphStyle(
-        'CustomContent',
-        parent=styles['Normal'],
-        fontSize=12,
-        spaceAfter=12,
-        alignment=TA_JUSTIFY,
-        leftIndent=20,
-        rightIndent=20
-    )
+    filepath = str(_REPORTS_DIR / filename)
     
     # Construir o conteúdo do PDF
     story = []
     
     # Título do relatório
-    story.append(Paragraph("CCR - RELATÓRIO DE INCIDENTE", title_style))
+    story.append(Paragraph("CCR - RELATÓRIO DE INCIDENTE", _TITLE_STYLE))
     story.append(Spacer(1, 20))
     
     # Informações do cabeçalho
-    story.append(Paragraph(f"<b>Título:</b> {titulo}", header_style))
-    story.append(Paragraph(f"<b>Data e Hora:</b> {data_hora}", header_style))
-    story.append(Paragraph(f"<b>Colaborador Responsável:</b> {colaborador_nome}", header_style))
+    story.append(Paragraph(f"<b>Título:</b> {titulo}", _HEADER_STYLE))
+    story.append(Paragraph(f"<b>Data e Hora:</b> {data_hora}", _HEADER_STYLE))
+    story.append(Paragraph(f"<b>Colaborador Responsável:</b> {colaborador_nome}", _HEADER_STYLE))
     story.append(Spacer(1, 20))
     
     # Conteúdo do relatório
-    story.append(Paragraph("<b>Descrição do Incidente:</b>", header_style))
-    story.append(Paragraph(conteudo, content_style))
+    story.append(Paragraph("<b>Descrição do Incidente:</b>", _HEADER_STYLE))
+    story.append(Paragraph(conteudo, _CONTENT_STYLE))
     story.append(Spacer(1, 30))
     
     # Rodapé
     footer_text = f"Relatório gerado automaticamente pela Assistente Ceci em {data_hora}"
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=10,
-        alignment=TA_CENTER,
-        textColor=red
-    )
-    story.append(Paragraph(footer_text, footer_style))
+    story.append(Paragraph(footer_text, _FOOTER_STYLE))
     
-    # Construir o PDF
+    # Construir o PDF (o ReportLab monta tudo em memória e só abre o arquivo ao final)
+    # Sem deflate nos streams de página: num PDF de uma página o ganho em bytes não paga a CPU
+    doc = SimpleDocTemplate(filepath, pagesize=A4, pageCompression=0)
     doc.build(story)
     
     return filepath
 
-def gerar_relatorio(descricao: str, tipo_usuario: str = "Passageiro", token: str | None = None) -> dict:
+async def gerar_relatorio(descricao: str, tipo_usuario: str = "Passageiro", token: str | None = None) -> dict:
     """
     Gera relatório apenas para colaboradores autenticados.
     Para passageiros, retorna erro de permissão.
+    O PDF é montado numa thread para não bloquear o event loop.
     """
     # Verifica se é passageiro tentando gerar relatório
     if tipo_usuario != "Colaborador":
@@ -138,13 +170,18 @@ def gerar_relatorio(descricao: str, tipo_usuario: str = "Passageiro", token: str
         }
     
     # Gera o relatório
-    now = datetime.datetime.now().strftime("%d/%m/%Y %H:%M")
+    dt = datetime.datetime.now()
+    data_str = f"{dt.day:02d}/{dt.month:02d}/{dt.year}"
+    hora_str = f"{dt.hour:02d}:{dt.minute:02d}"
+    now = f"{data_str} {hora_str}"
     colaborador_nome = colaborador_info.get("nome", "Colaborador CCR")
-    titulo = f"Relatório de Incidente - {now.split(' ')[0]}"
+    titulo = f"Relatório de Incidente - {data_str}"
     
     try:
         # Gera o PDF
-        pdf_path = gerar_pdf_relatorio(titulo, descricao, colaborador_nome, now)
+        pdf_path = await asyncio.to_thread(
+            gerar_pdf_relatorio, titulo, descricao, colaborador_nome, now, gerado_em=dt
+        )
         pdf_filename = os.path.basename(pdf_path)
         
         return {
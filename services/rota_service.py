@@ -2,30 +2,77 @@
 
 from __future__ import annotations
 
-import json
+import threading
+import time
 import unicodedata
 from dataclasses import dataclass
-from difflib import get_close_matches
-from functools import lru_cache
+from functools import lru_cache, partial
+from itertools import pairwise
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
 import networkx as nx
+import orjson
 import requests
+from rapidfuzz import fuzz, process
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 DATA_FILE = Path("data/data_linhas.json")
 TEMPO_BASE = 3
+STATUS_URL = "https://www.diretodostrens.com.br/api/status"
+STATUS_TTL_SECONDS = 60
+STATUS_FAILURE_TTL_SECONDS = 15
 
+# Sessão reaproveitada: renovações do status não repagam o handshake TLS
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=Retry(total=1, backoff_factor=0.2)),
+)
+_STATUS_LOCK = threading.Lock()
+# (instante monotônico de expiração, último status obtido)
+_status_cache: Tuple[float, Dict[str, str]] = (0.0, {})
 
+
+# Acentos do português mapeados direto para ASCII; o que sobrar cai no NFKD
+_ACCENT_TBL = str.maketrans(
+    "áàâãäéèêëíìîïóòôõöúùûüçñÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑ",
+    "aaaaaeeeeiiiiooooouuuucnAAAAAEEEEIIIIOOOOOUUUUCN",
+)
+
+
+@lru_cache(maxsize=4096)
 def _normalize(texto: str) -> str:
-    return unicodedata.normalize("NFKD", texto or "").encode("ASCII", "ignore").decode("ASCII").casefold()
+    if not texto:
+        return ""
+    if texto.isascii():
+        return texto.casefold()
+    traduzido = texto.translate(_ACCENT_TBL)
+    if traduzido.isascii():
+        return traduzido.casefold()
+    return unicodedata.normalize("NFKD", traduzido).encode("ASCII", "ignore").decode("ASCII").casefold()
 
 
 @lru_cache(maxsize=1)
 def _load_data() -> Dict:
-    with DATA_FILE.open("r", encoding="utf-8") as fh:
-        return json.load(fh)
+    return orjson.loads(DATA_FILE.read_bytes())
+
+
+@lru_cache(maxsize=1)
+def _station_to_lines() -> Dict[str, Tuple[str, ...]]:
+    """Índice estação -> linhas materializado uma vez a partir do JSON aninhado."""
+    indice: Dict[str, List[str]] = {}
+    for linha in _load_data().get("linhas", []):
+        for estacao in linha.get("estacoes", []):
+            indice.setdefault(estacao, []).append(linha.get("nome"))
+    return {estacao: tuple(linhas) for estacao, linhas in indice.items()}
+
+
+@lru_cache(maxsize=1)
+def _line_names() -> frozenset[str]:
+    return frozenset(linha.get("nome", "") for linha in _load_data().get("linhas", []))
 
 
 @lru_cache(maxsize=1)
@@ -47,53 +94,78 @@ def _build_graph() -> nx.Graph:
                 operadora=operadora,
             )
 
-    for estacao in list(graph.nodes):
-        linhas_encontradas = [
-            linha.get("nome")
-            for linha in dados.get("linhas", [])
-            if estacao in linha.get("estacoes", [])
-        ]
-        if len(linhas_encontradas) > 1:
-            graph.nodes[estacao]["baldeacoes"] = linhas_encontradas
+    for estacao, linhas_encontradas in _station_to_lines().items():
+        if len(linhas_encontradas) > 1 and estacao in graph:
+            graph.nodes[estacao]["baldeacoes"] = list(linhas_encontradas)
 
     return graph
 
 
-@lru_cache(maxsize=1)
 def _fetch_status() -> Dict[str, str]:
+    # TTL em vez de cache eterno; falhas expiram antes para o status voltar logo após uma queda
+    expira_em, status = _status_cache
+    if time.monotonic() < expira_em:
+        return status
+    # Só uma thread renova por vez; as outras reaproveitam o resultado dela
+    with _STATUS_LOCK:
+        return _refresh_status()
+
+
+def _refresh_status() -> Dict[str, str]:
+    global _status_cache
+    expira_em, status = _status_cache
+    if time.monotonic() < expira_em:
+        return status
+
     status_operacao: Dict[str, str] = {}
+    ttl = STATUS_TTL_SECONDS
     try:
-        resp = requests.get(
-            "https://www.diretodostrens.com.br/api/status",
+        resp = _SESSION.get(
+            STATUS_URL,
             timeout=5,
             verify=False,
         )
         resp.raise_for_status()
-        for item in resp.json():
+        for item in orjson.loads(resp.content):
             nome = _normalize(item.get("nome", ""))
             status_operacao[nome] = item.get("situacao", "").strip()
     except Exception:
         # Silencia falhas de rede para não derrubar o cálculo de rota
-        pass
+        status_operacao = {}
+        ttl = STATUS_FAILURE_TTL_SECONDS
+    _status_cache = (time.monotonic() + ttl, status_operacao)
     return status_operacao
 
 
 @lru_cache(maxsize=1)
 def list_all_stations() -> List[str]:
-    dados = _load_data()
-    estacoes = [est for linha in dados.get("linhas", []) for est in linha.get("estacoes", [])]
-    return sorted(set(estacoes))
+    return sorted(_station_to_lines())
+
 
+def _penalidades_por_linha(status: Dict[str, str]) -> Dict[str, int]:
+    """Penalidade de status por linha, calculada uma vez por rota em vez de por aresta."""
+    penalidades: Dict[str, int] = {}
+    for linha in _line_names():
+        situacao = status.get(_normalize(linha), "").lower()
+        penalidades[linha] = 10 if any(p in situacao for p in ("reduzida", "falha", "interrup")) else 0
+    return penalidades
 
-def _calcular_peso(u: str, v: str, modo: str = "rapido") -> float:
+
+def _calcular_peso(
+    u: str,
+    v: str,
+    atributos: Optional[Dict] = None,
+    modo: str = "rapido",
+    penalidades: Optional[Dict[str, int]] = None,
+) -> float:
     graph = _build_graph()
-    atributos = graph.get_edge_data(u, v) or {}
+    if atributos is None:
+        atributos = graph.get_edge_data(u, v) or {}
+    if penalidades is None:
+        penalidades = _penalidades_por_linha(_fetch_status())
     tempo = atributos.get("tempo", TEMPO_BASE)
 
-    linha = atributos.get("linha", "")
-    situacao = _fetch_status().get(_normalize(linha), "").lower()
-    if any(p in situacao for p in ("reduzida", "falha", "interrup")):
-        tempo += 10
+    tempo += penalidades.get(atributos.get("linha", ""), 0)
 
     if modo == "simples" and graph.nodes[u].get("baldeacoes"):
         tempo += 3
@@ -103,59 +175,67 @@ def _calcular_peso(u: str, v: str, modo: str = "rapido") -> float:
     return tempo
 
 
-def _custo_total(caminho: List[str], modo: str) -> float:
+def _custo_total(caminho: List[str], modo: str, penalidades: Optional[Dict[str, int]] = None) -> float:
     total = 0.0
-    for u, v in zip(caminho[:-1], caminho[1:]):
-        total += _calcular_peso(u, v, modo)
+    for u, v in pairwise(caminho):
+        total += _calcular_peso(u, v, modo=modo, penalidades=penalidades)
     return total
 
 
 def _detectar_baldeacoes(caminho: List[str]) -> List[Tuple[str, str, str]]:
     graph = _build_graph()
-    segmentos = [
-        (u, v, graph.get_edge_data(u, v) or {})
-        for u, v in zip(caminho[:-1], caminho[1:])
-    ]
-
     baldeacoes: List[Tuple[str, str, str]] = []
-    linhas_previas: List[str] = []
+    linha_anterior: Optional[str] = None
 
-    for idx, (_, _, dados) in enumerate(segmentos):
-        linha_atual = dados.get("linha", "")
-        linhas_previas.append(linha_atual)
-        if idx == 0:
-            continue
-        if linha_atual != linhas_previas[idx - 1]:
-            baldeacoes.append((caminho[idx], linhas_previas[idx - 1], linha_atual))
+    # Uma passada pelos pares consecutivos, sem fatias nem lista auxiliar de linhas
+    for u, v in pairwise(caminho):
+        linha_atual = (graph.get_edge_data(u, v) or {}).get("linha", "")
+        if linha_anterior is not None and linha_atual != linha_anterior:
+            baldeacoes.append((u, linha_anterior, linha_atual))
+        linha_anterior = linha_atual
 
     return baldeacoes
 
 
+@lru_cache(maxsize=1)
+def _normalized_station_map() -> Dict[str, str]:
+    return {_normalize(est): est for est in list_all_stations()}
+
+
+@lru_cache(maxsize=1)
+def _normalized_station_keys() -> Tuple[str, ...]:
+    return tuple(_normalized_station_map().keys())
+
+
+@lru_cache(maxsize=512)
 def _resolver_estacao(nome: str) -> Optional[str]:
     if not nome:
         return None
 
-    estacoes = list_all_stations()
     normalizado = _normalize(nome)
-    mapa_normalizado = { _normalize(est): est for est in estacoes }
+    mapa_normalizado = _normalized_station_map()
 
     if normalizado in mapa_normalizado:
         return mapa_normalizado[normalizado]
 
-    candidatos = get_close_matches(normalizado, mapa_normalizado.keys(), n=1, cutoff=0.8)
-    if candidatos:
-        return mapa_normalizado[candidatos[0]]
+    # Levenshtein em C (rapidfuzz); score_cutoff=80 equivale ao antigo cutoff=0.8 do difflib
+    encontrado = process.extractOne(
+        normalizado, _normalized_station_keys(), scorer=fuzz.ratio, score_cutoff=80
+    )
+    if encontrado:
+        return mapa_normalizado[encontrado[0]]
     return None
 
 
-@dataclass
+@dataclass(frozen=True)
 class RoutePlan:
+    # Imutável: planos ficam em cache e são compartilhados entre requisições
     origem: str
     destino: str
     modo: str
-    caminho: List[str]
+    caminho: Tuple[str, ...]
     custo_estimado: float
-    baldeacoes: List[Tuple[str, str, str]]
+    baldeacoes: Tuple[Tuple[str, str, str], ...]
 
     def formatar(self) -> str:
         minutos = max(int(round(self.custo_estimado)), len(self.caminho) - 1)
@@ -175,45 +255,48 @@ def plan_route(origem: str, destino: str) -> RoutePlan:
     if not origem_resolvida or not destino_resolvido:
         raise ValueError("Não consegui identificar a estação de origem ou destino informado.")
 
+    # O snapshot do status entra na chave: quando a operação muda, o cache se renova sozinho
+    status = tuple(sorted(_fetch_status().items()))
+    return _plan_route_cached(origem_resolvida, destino_resolvido, status)
+
+
+@lru_cache(maxsize=4096)
+def _plan_route_cached(
+    origem_resolvida: str,
+    destino_resolvido: str,
+    status: Tuple[Tuple[str, str], ...],
+) -> RoutePlan:
     graph = _build_graph()
-    modos = ("rapido", "simples", "acessivel")
-    melhores: Dict[str, RoutePlan] = {}
-
-    for modo in modos:
-        try:
-            if modo == "simples":
-                caminho = nx.dijkstra_path(
-                    graph,
-                    origem_resolvida,
-                    destino_resolvido,
-                    weight=lambda u, v, _: _calcular_peso(u, v, modo),
-                )
-            else:
-                caminho = nx.astar_path(
-                    graph,
-                    origem_resolvida,
-                    destino_resolvido,
-                    heuristic=lambda u, v: TEMPO_BASE * (len(nx.shortest_path(graph, u, v)) - 1),
-                    weight=lambda u, v, _: _calcular_peso(u, v, modo),
-                )
-
-            custo = _custo_total(caminho, modo)
-            melhores[modo] = RoutePlan(
-                origem=origem_resolvida,
-                destino=destino_resolvido,
-                modo=modo,
-                caminho=caminho,
-                custo_estimado=custo,
-                baldeacoes=_detectar_baldeacoes(caminho),
-            )
-        except nx.NetworkXNoPath:
-            continue
 
-    if not melhores:
-        raise ValueError(f"Não há rota disponível de {origem_resolvida} até {destino_resolvido}.")
+    # Uma busca só: as penalidades de "simples" e "acessivel" são não-negativas e somadas ao
+    # peso de "rapido", então o custo mínimo entre os três modos é sempre o do "rapido"
+    modo = "rapido"
 
-    melhor = min(melhores.values(), key=lambda plano: plano.custo_estimado)
-    return melhor
+    # Heurística admissível calculada uma vez: cada aresta custa ao menos TEMPO_BASE
+    saltos_ate_destino = nx.single_source_shortest_path_length(graph, destino_resolvido)
+    heuristica = lambda u, _v: TEMPO_BASE * saltos_ate_destino.get(u, 0)
+    penalidades = _penalidades_por_linha(dict(status))
+    peso = partial(_calcular_peso, modo=modo, penalidades=penalidades)
+
+    try:
+        caminho = nx.astar_path(
+            graph,
+            origem_resolvida,
+            destino_resolvido,
+            heuristic=heuristica,
+            weight=peso,
+        )
+    except nx.NetworkXNoPath:
+        raise ValueError(f"Não há rota disponível de {origem_resolvida} até {destino_resolvido}.") from None
+
+    return RoutePlan(
+        origem=origem_resolvida,
+        destino=destino_resolvido,
+        modo=modo,
+        caminho=tuple(caminho),
+        custo_estimado=_custo_total(caminho, modo, penalidades),
+        baldeacoes=tuple(_detectar_baldeacoes(caminho)),
+    )
 
 
 def describe_route(origem: str, destino: str) -> str:
@@ -2,14 +2,20 @@
 
 from __future__ import annotations
 
-from typing import AsyncIterator
+from typing import AsyncIterator, Final
+
+__all__ = ("SmartRouter",)
+
+_LEGACY_MSG: Final[str] = (
+    "A arquitetura da Ceci foi atualizada para o modelo LLM-first."
+    " Utilize `pipeline.process_user_input` diretamente."
+)
 
 
 class SmartRouter:
     """Stub legado: direcione consumidores para ``pipeline.process_user_input``."""
 
+    __slots__ = ()
+
     async def route_and_respond(self, *_args, **_kwargs) -> AsyncIterator[str]:
-        yield (
-            "A arquitetura da Ceci foi atualizada para o modelo LLM-first."
-            " Utilize `pipeline.process_user_input` diretamente."
-        )
\ No newline at end of file
+        yield _LEGACY_MSG
@@ -0,0 +1,89 @@
+"""Testes offline do gate de tópico (emergência / transporte / fora de escopo)."""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, List, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import orchestrator
+from orchestrator import LLMOrchestrator, _build_topic_automaton, _normalizar_topico
+from services import rota_service
+
+
+CASES: List[Tuple[str, str]] = [
+    # Emergência: grafias com e sem acento, em qualquer caixa
+    ("Socorro, acabei de sofrer um assédio no metrô!", "emergency"),
+    ("sofri assedio na plataforma", "emergency"),
+    ("Houve uma AGRESSÃO no vagão", "emergency"),
+    ("agressao na estação", "emergency"),
+    ("Emergência na linha 3", "emergency"),
+    ("me robaron el celular", "emergency"),
+    ("I need help, my phone was stolen", "emergency"),
+    # "robô" não pode virar o espanhol "robo" ao dobrar acentos
+    ("o robô da estação Sé está quebrado", "transport"),
+    ("Quem inventou o robô?", "offtopic"),
+    # Borda de token: palavras que só contêm uma palavra-chave não contam
+    ("isso foi helpful", "offtopic"),
+    ("vi no youtube", "offtopic"),
+    # Transporte: palavras-chave dobradas, frases e nomes de estação
+    ("Qual é a tarifa do metrô?", "transport"),
+    ("Como recarregar o Bilhete Único?", "transport"),
+    ("Quais ônibus passam aqui?", "transport"),
+    ("Como chego em Vila Madalena saindo da Sé?", "transport"),
+    ("estacao paraiso fica aberta ate que horas", "transport"),
+    # Fora de escopo
+    ("Quem inventou a lâmpada?", "offtopic"),
+    ("Escreva um script em Python para ordenar uma lista.", "offtopic"),
+    ("", "offtopic"),
+]
+
+
+def build_gate() -> Any:
+    """Monta só o que ``_scan_topic`` usa, sem cliente OpenAI nem índice RAG."""
+    estacoes = frozenset(
+        nome for nome in (_normalizar_topico(est) for est in rota_service.list_all_stations()) if nome
+    )
+    return SimpleNamespace(_topic_automaton=_build_topic_automaton(estacoes))
+
+
+def run_cases(label: str, gate: Any) -> int:
+    failures = 0
+    print(f"\n=== {label} ===")
+    for texto, esperado in CASES:
+        obtido = LLMOrchestrator._scan_topic(gate, texto)
+        if obtido != esperado:
+            failures += 1
+            print(f"⚠️  {texto!r}: esperado {esperado}, obtido {obtido}")
+    if not failures:
+        print(f"✅  {len(CASES)} casos atendidos")
+    return failures
+
+
+def main() -> None:
+    failures = 0
+    if orchestrator.ahocorasick is not None:
+        failures += run_cases("Aho-Corasick", build_gate())
+    else:
+        print("pyahocorasick não instalado: só o fallback será testado.")
+
+    # Fallback em regex usado quando a extensão C não está disponível
+    ahocorasick = orchestrator.ahocorasick
+    orchestrator.ahocorasick = None
+    try:
+        failures += run_cases("Fallback sem pyahocorasick", build_gate())
+    finally:
+        orchestrator.ahocorasick = ahocorasick
+
+    if failures:
+        raise SystemExit(f"{failures} caso(s) falhou/falharam – verifique o log acima.")
+    print("\nTodos os casos passaram.")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import asyncio
+import re
 import sys
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
@@ -25,6 +26,10 @@ TRANSIENT_ERRORS = (
     "problema temporário",
     "não foi possível"  # casos gerais de falha de modelo
 )
+# Uma única varredura em vez de um ``in`` por mensagem de erro
+TRANSIENT_RE = re.compile("|".join(map(re.escape, TRANSIENT_ERRORS)))
+# Casos independentes rodam em paralelo, limitados para não estourar o rate limit do modelo
+MAX_CONCURRENT_CASES = 4
 
 
 @dataclass
@@ -35,11 +40,25 @@ class TestCase:
     token: Optional[str] = None
     expectations: Iterable[str] = field(default_factory=list)
     forbidden: Iterable[str] = field(default_factory=list)
-
-
-async def collect_response(message: str, user_type: str, token: Optional[str]) -> str:
+    _exp_lower: tuple[str, ...] = field(init=False, repr=False)
+    _forb_lower: tuple[str, ...] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # Expectativas são constantes: normaliza uma vez em vez de a cada verificação
+        self.expectations = tuple(self.expectations)
+        self.forbidden = tuple(self.forbidden)
+        self._exp_lower = tuple(s.lower() for s in self.expectations)
+        self._forb_lower = tuple(s.lower() for s in self.forbidden)
+
+
+async def collect_response(
+    message: str,
+    user_type: str,
+    token: Optional[str],
+    session_id: Optional[str] = None,
+) -> str:
     chunks: List[str] = []
-    async for chunk in process_user_input(message, user_type, token):
+    async for chunk in process_user_input(message, user_type, token, session_id=session_id):
         chunks.append(chunk)
     return "".join(chunks).strip()
 
@@ -141,25 +160,41 @@ async def run_cases() -> None:
         ),
     ]
 
+    sem = asyncio.Semaphore(MAX_CONCURRENT_CASES)
+
+    async def run_one(case: TestCase) -> tuple[TestCase, str, int]:
+        # Sessão própria por caso: em paralelo, a sessão anônima compartilhada misturaria históricos
+        session_id = f"test::{case.name}"
+        async with sem:
+            max_attempts = 2
+            for attempt in range(1, max_attempts + 1):
+                response = await collect_response(case.prompt, case.user_type, case.token, session_id)
+                normalized_attempt = response.lower()
+                if TRANSIENT_RE.search(normalized_attempt) and attempt < max_attempts:
+                    await asyncio.sleep(1)
+                    continue
+                break
+        return case, response, attempt - 1
+
+    results = await asyncio.gather(*(run_one(case) for case in cases))
+
     failures = 0
 
-    for case in cases:
+    # Relatório na ordem original dos casos, depois que todos terminaram
+    for case, response, retries in results:
         print(f"\n=== {case.name} ===")
         print(f"Usuário: {case.user_type}\nPergunta: {case.prompt}")
-        max_attempts = 2
-        for attempt in range(1, max_attempts + 1):
-            response = await collect_response(case.prompt, case.user_type, case.token)
-            normalized_attempt = response.lower()
-            if any(err in normalized_attempt for err in TRANSIENT_ERRORS) and attempt < max_attempts:
-                print("⚠️  Resposta sinalizou erro transitório, tentando novamente...")
-                await asyncio.sleep(1)
-                continue
-            break
+        if retries:
+            print("⚠️  Resposta sinalizou erro transitório, caso repetido.")
         print("Resposta:\n" + response)
 
         normalized = response.lower()
-        unmet = [snippet for snippet in case.expectations if snippet.lower() not in normalized]
-        forbidden_hits = [snippet for snippet in case.forbidden if snippet.lower() in normalized]
+        unmet = [
+            snippet for snippet, lower in zip(case.expectations, case._exp_lower) if lower not in normalized
+        ]
+        forbidden_hits = [
+            snippet for snippet, lower in zip(case.forbidden, case._forb_lower) if lower in normalized
+        ]
         if unmet:
             failures += 1
             print(f"⚠️  Expectativas não encontradas: {', '.join(unmet)}")